@@ -1,8 +1,9 @@
 import numpy as np
 import librosa
 from dataclasses import dataclass, field
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
+from .note_cleanup import NoteCleanup, clean_pitch_track
 from .text_export import midi_to_tab
 
 @dataclass
@@ -20,6 +21,7 @@ class SegmentAnalysis:
     key: str
     tempo: float
     notes: List[NoteEvent] = field(default_factory=list)
+    raw_note_count: int = 0
 
 
 @dataclass
@@ -28,32 +30,65 @@ class PercussionEvent:
     hit_type: str
 
 
-def extract_percussion_events(y: np.ndarray, sr: int) -> List[PercussionEvent]:
-    """Detect basic percussion hits in an audio signal."""
-    _, y_perc = librosa.effects.hpss(y)
+# Frequency bands (Hz) used to label percussion hits. ``None`` means unbounded.
+PERCUSSION_BANDS = {
+    "Kick": (50, 150),
+    "Snare/Clap": (200, 800),
+    "Hi-hat": (5000, None),
+}
+
+
+def _classify_hit(
+    spectrum: np.ndarray, freqs: np.ndarray, bands: Dict = PERCUSSION_BANDS
+) -> str:
+    """Return the percussion label whose band holds the most energy."""
+    energies = {}
+    for name, (low, high) in bands.items():
+        band = freqs >= low
+        if high is not None:
+            band &= freqs <= high
+        energies[name] = spectrum[band].sum()
+    return max(energies, key=energies.get)
+
+
+def _percussive_onsets(y_perc: np.ndarray, sr: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return onset frames and the magnitude spectrogram of ``y_perc``."""
     onset_env = librosa.onset.onset_strength(y=y_perc, sr=sr)
     onset_frames = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr)
-    S = np.abs(librosa.stft(y_perc))
+    return onset_frames, np.abs(librosa.stft(y_perc))
+
+
+def _label_hits(
+    onset_frames: np.ndarray, S: np.ndarray, sr: int, bands: Dict = PERCUSSION_BANDS
+) -> List[PercussionEvent]:
     freqs = librosa.fft_frequencies(sr=sr)
     events: List[PercussionEvent] = []
     for frame in onset_frames:
         if frame >= S.shape[1]:
             continue
-        spectrum = S[:, frame]
-        kick = spectrum[(freqs >= 50) & (freqs <= 150)].sum()
-        snare = spectrum[(freqs >= 200) & (freqs <= 800)].sum()
-        hihat = spectrum[freqs >= 5000].sum()
-        energies = {
-            "Kick": kick,
-            "Snare/Clap": snare,
-            "Hi-hat": hihat,
-        }
-        hit_type = max(energies, key=energies.get)
+        hit_type = _classify_hit(S[:, frame], freqs, bands)
         time = float(librosa.frames_to_time(frame, sr=sr))
         events.append(PercussionEvent(time=time, hit_type=hit_type))
     return events
 
 
+def extract_percussion_events(
+    y: np.ndarray, sr: int, bands: Dict = PERCUSSION_BANDS
+) -> List[PercussionEvent]:
+    """Detect basic percussion hits in an audio signal."""
+    _, y_perc = librosa.effects.hpss(y)
+    onset_frames, S = _percussive_onsets(y_perc, sr)
+    return _label_hits(onset_frames, S, sr, bands)
+
+
+def _make_note(name: str, start: float, duration: float) -> NoteEvent:
+    """Build a :class:`NoteEvent` for ``name`` including its guitar position."""
+    midi_val = int(librosa.note_to_midi(name))
+    pos = midi_to_tab(midi_val)
+    string, fret = pos if pos is not None else (None, None)
+    return NoteEvent(name, start, duration, midi_val, string, fret)
+
+
 def _group_notes(times: np.ndarray, notes: np.ndarray, offset: float) -> List[NoteEvent]:
     events: List[NoteEvent] = []
     if len(notes) == 0:
@@ -62,34 +97,10 @@ def _group_notes(times: np.ndarray, notes: np.ndarray, offset: float) -> List[No
     start_time = times[0]
     for n, t in zip(notes[1:], times[1:]):
         if n != current:
-            midi_val = int(librosa.note_to_midi(current))
-            pos = midi_to_tab(midi_val)
-            string, fret = pos if pos is not None else (None, None)
-            events.append(
-                NoteEvent(
-                    current,
-                    start_time + offset,
-                    t - start_time,
-                    midi_val,
-                    string,
-                    fret,
-                )
-            )
+            events.append(_make_note(current, start_time + offset, t - start_time))
             current = n
             start_time = t
-    midi_val = int(librosa.note_to_midi(current))
-    pos = midi_to_tab(midi_val)
-    string, fret = pos if pos is not None else (None, None)
-    events.append(
-        NoteEvent(
-            current,
-            start_time + offset,
-            times[-1] - start_time,
-            midi_val,
-            string,
-            fret,
-        )
-    )
+    events.append(_make_note(current, start_time + offset, times[-1] - start_time))
     return events
 
 
@@ -122,34 +133,129 @@ def _estimate_key_fallback(segment: np.ndarray, sr: int) -> str:
         return "Unknown"
 
 
-def analyze_segment(segment: np.ndarray, sr: int, name: str, offset: float) -> SegmentAnalysis:
-    tempo, _ = librosa.beat.beat_track(y=segment, sr=sr)
-    try:
-        key = librosa.key.estimate_key(segment, sr=sr)
-    except AttributeError:
-        key = _estimate_key_fallback(segment, sr)
-    f0, _, _ = librosa.pyin(segment,
-                           fmin=librosa.note_to_hz('C2'),
-                           fmax=librosa.note_to_hz('C7'))
+# Default pyin search range.
+PITCH_FMIN = librosa.note_to_hz('C2')
+PITCH_FMAX = librosa.note_to_hz('C7')
+
+
+def _track_pitch(
+    segment: np.ndarray, sr: int, fmin: float = PITCH_FMIN, fmax: float = PITCH_FMAX
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the pyin f0 track and voiced probabilities of ``segment``."""
+    f0, _, voiced_prob = librosa.pyin(segment, fmin=fmin, fmax=fmax, sr=sr)
+    return f0, voiced_prob
+
+
+def _raw_notes(f0: np.ndarray, sr: int, offset: float) -> List[NoteEvent]:
     times = librosa.times_like(f0, sr=sr)
     mask = ~np.isnan(f0)
     notes = librosa.hz_to_note(f0[mask])
     times = times[mask]
-    events = _group_notes(times, notes, offset)
-    return SegmentAnalysis(name=name, key=key, tempo=float(tempo), notes=events)
-
-
-def analyze_audio(path: str) -> Tuple[List[SegmentAnalysis], List[PercussionEvent]]:
-    y, sr = librosa.load(path)
-    total = len(y)
-    third = total // 3
-    segments = [
-        ("Intro", y[:third], 0.0),
-        ("Mid", y[third: 2 * third], third / sr),
-        ("Outro", y[2 * third:], 2 * third / sr),
+    return _group_notes(times, notes, offset)
+
+
+def _count_raw_notes(f0: np.ndarray) -> int:
+    """Number of events :func:`_group_notes` would produce for ``f0``."""
+    f0 = f0[~np.isnan(f0)]
+    if len(f0) == 0:
+        return 0
+    midi = np.rint(librosa.hz_to_midi(f0))
+    return int(np.count_nonzero(midi[1:] != midi[:-1])) + 1
+
+
+def _cleaned_notes(
+    f0: np.ndarray, voiced_prob: np.ndarray, sr: int, offset: float, cleanup: NoteCleanup
+) -> List[NoteEvent]:
+    starts, durations, midi = clean_pitch_track(f0, voiced_prob, sr, config=cleanup)
+    return [
+        _make_note(librosa.midi_to_note(int(m)), float(s) + offset, float(d))
+        for s, d, m in zip(starts, durations, midi)
+    ]
+
+
+def _segment_notes(
+    f0: np.ndarray,
+    voiced_prob: np.ndarray,
+    sr: int,
+    offset: float,
+    cleanup: Optional[NoteCleanup],
+) -> List[NoteEvent]:
+    if cleanup is None:
+        return _raw_notes(f0, sr, offset)
+    return _cleaned_notes(f0, voiced_prob, sr, offset, cleanup)
+
+
+def _extract_notes(
+    segment: np.ndarray,
+    sr: int,
+    offset: float,
+    fmin: float = PITCH_FMIN,
+    fmax: float = PITCH_FMAX,
+) -> List[NoteEvent]:
+    """Track the melody of ``segment`` with pyin and group it into notes."""
+    f0, _ = _track_pitch(segment, sr, fmin, fmax)
+    return _raw_notes(f0, sr, offset)
+
+
+def _estimate_tempo(segment: np.ndarray, sr: int) -> float:
+    tempo, _ = librosa.beat.beat_track(y=segment, sr=sr)
+    return float(tempo)
+
+
+def _estimate_key(segment: np.ndarray, sr: int) -> str:
+    try:
+        return librosa.key.estimate_key(segment, sr=sr)
+    except AttributeError:
+        return _estimate_key_fallback(segment, sr)
+
+
+# Default segment boundaries as fractions of the song length.
+SEGMENT_SPLIT = (1 / 3, 2 / 3)
+
+
+def _split_segments(
+    y: np.ndarray, sr: int, split: Tuple[float, float] = SEGMENT_SPLIT
+) -> List[Tuple[str, np.ndarray, float]]:
+    """Split ``y`` into Intro, Mid and Outro at the given fractions."""
+    first, second = (int(len(y) * f) for f in split)
+    return [
+        ("Intro", y[:first], 0.0),
+        ("Mid", y[first:second], first / sr),
+        ("Outro", y[second:], second / sr),
     ]
-    analyses: List[SegmentAnalysis] = []
-    for name, seg, offset in segments:
-        analyses.append(analyze_segment(seg, sr, name, offset))
-    percussion = extract_percussion_events(y, sr)
-    return analyses, percussion
+
+
+def analyze_segment(
+    segment: np.ndarray,
+    sr: int,
+    name: str,
+    offset: float,
+    cleanup: Optional[NoteCleanup] = None,
+) -> SegmentAnalysis:
+    """Analyze one segment.
+
+    When ``cleanup`` is given the pitch track is cleaned with
+    :func:`~song_analyzer.note_cleanup.clean_pitch_track` before notes are
+    built; otherwise every change of note name starts a new event.
+    """
+    f0, voiced_prob = _track_pitch(segment, sr)
+    return SegmentAnalysis(
+        name=name,
+        key=_estimate_key(segment, sr),
+        tempo=_estimate_tempo(segment, sr),
+        notes=_segment_notes(f0, voiced_prob, sr, offset, cleanup),
+        raw_note_count=_count_raw_notes(f0),
+    )
+
+
+def analyze_audio(
+    path: str, cleanup: Optional[NoteCleanup] = NoteCleanup()
+) -> Tuple[List[SegmentAnalysis], List[PercussionEvent]]:
+    """Analyze ``path`` with the default settings.
+
+    This runs a fresh :class:`~song_analyzer.pipeline.AnalysisPipeline`; keep
+    a pipeline around instead to reuse intermediate results between runs.
+    """
+    from .pipeline import AnalysisPipeline, AnalysisSettings
+
+    return AnalysisPipeline().run(path, AnalysisSettings(cleanup=cleanup))
@@ -1,7 +1,10 @@
 import os
+import librosa
 from PyQt5 import QtWidgets, QtCore
-from .analysis import analyze_audio
+from .analysis import PERCUSSION_BANDS
 from .midi_export import export_midi
+from .note_cleanup import NoteCleanup
+from .pipeline import AnalysisPipeline, AnalysisSettings
 from .piano_roll import PianoRollWidget
 from .text_export import export_text as export_text_file
 
@@ -33,6 +36,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.file_path = None
         self.segments = []
         self.percussion = []
+        self.pipeline = AnalysisPipeline()
 
         central = QtWidgets.QWidget()
         layout = QtWidgets.QVBoxLayout(central)
@@ -66,6 +70,56 @@ class MainWindow(QtWidgets.QMainWindow):
         self.reset_btn.setToolTip('Clear the current song and analysis')
         self.view_toggle.setToolTip('Toggle between piano roll and guitar tab views')
 
+        settings = QtWidgets.QHBoxLayout()
+        note_names = [f'C{octave}' for octave in range(1, 9)]
+        self.fmin_box = QtWidgets.QComboBox()
+        self.fmin_box.addItems(note_names)
+        self.fmin_box.setCurrentText('C2')
+        self.fmax_box = QtWidgets.QComboBox()
+        self.fmax_box.addItems(note_names)
+        self.fmax_box.setCurrentText('C7')
+        self.split_start = QtWidgets.QDoubleSpinBox()
+        self.split_start.setRange(1, 98)
+        self.split_start.setValue(100 / 3)
+        self.split_end = QtWidgets.QDoubleSpinBox()
+        self.split_end.setRange(2, 99)
+        self.split_end.setValue(200 / 3)
+        for spin in (self.split_start, self.split_end):
+            spin.setSuffix(' %')
+        self.clean_check = QtWidgets.QCheckBox('Clean notes')
+        self.clean_check.setChecked(True)
+        self.min_note_spin = QtWidgets.QSpinBox()
+        self.min_note_spin.setRange(0, 1000)
+        self.min_note_spin.setValue(int(NoteCleanup().min_duration * 1000))
+        self.min_note_spin.setSuffix(' ms')
+        self.clean_check.toggled.connect(self.min_note_spin.setEnabled)
+        self.hihat_spin = QtWidgets.QSpinBox()
+        self.hihat_spin.setRange(1000, 11000)
+        self.hihat_spin.setValue(PERCUSSION_BANDS['Hi-hat'][0])
+        self.hihat_spin.setSuffix(' Hz')
+        for label, widget in (
+            ('Pitch', self.fmin_box),
+            ('to', self.fmax_box),
+            ('Split', self.split_start),
+            ('/', self.split_end),
+            ('', self.clean_check),
+            ('Min note', self.min_note_spin),
+            ('Hi-hat from', self.hihat_spin),
+        ):
+            if label:
+                settings.addWidget(QtWidgets.QLabel(label))
+            settings.addWidget(widget)
+        settings.addStretch()
+        layout.addLayout(settings)
+
+        self.fmin_box.setToolTip('Lowest pitch considered for melody tracking')
+        self.fmax_box.setToolTip('Highest pitch considered for melody tracking')
+        self.split_start.setToolTip('Where the intro ends, as a percentage of the song')
+        self.split_end.setToolTip('Where the outro starts, as a percentage of the song')
+        self.clean_check.setToolTip('Merge vibrato and pitch jitter into single notes')
+        self.min_note_spin.setToolTip('Shorter notes are merged into their neighbours')
+        self.hihat_spin.setToolTip('Lowest frequency counted as hi-hat energy')
+
         self.info = QtWidgets.QTextEdit()
         self.info.setReadOnly(True)
         self.info.setToolTip('Displays details about the analyzed segments')
@@ -97,23 +151,57 @@ class MainWindow(QtWidgets.QMainWindow):
     def analyze(self):
         if not self.file_path:
             return
+        settings = self.settings()
+        if settings.fmin >= settings.fmax:
+            QtWidgets.QMessageBox.warning(
+                self, 'Invalid pitch range', 'The lowest pitch must be below the highest pitch.'
+            )
+            return
+        if settings.split[0] >= settings.split[1]:
+            QtWidgets.QMessageBox.warning(
+                self, 'Invalid split', 'The intro must end before the outro starts.'
+            )
+            return
         dialog = QtWidgets.QProgressDialog('Analyzing song...', None, 0, 0, self)
         dialog.setWindowTitle('Please wait')
         dialog.setWindowModality(QtCore.Qt.ApplicationModal)
         dialog.setCancelButton(None)
         dialog.show()
         QtWidgets.QApplication.processEvents()
-        self.segments, self.percussion = analyze_audio(self.file_path)
+        self.segments, self.percussion = self.pipeline.run(self.file_path, settings)
         name = os.path.basename(self.file_path)
         info_lines = [f'File: {name}']
+        if self.pipeline.last_run:
+            stages = ', '.join(self.pipeline.last_run)
+            info_lines.append(f'Updated stages: {stages}')
+        else:
+            info_lines.append('All results reused from the previous analysis')
         for seg in self.segments:
             notes = ', '.join(n.name for n in seg.notes[:10])
-            line = f"{seg.name}: Key {seg.key}, Tempo {seg.tempo:.1f} BPM\nNotes: {notes}"
+            line = (
+                f"{seg.name}: Key {seg.key}, Tempo {seg.tempo:.1f} BPM\n"
+                f"Notes ({len(seg.notes)} from {seg.raw_note_count} raw events): {notes}"
+            )
             info_lines.append(line)
         self.info.setText('\n\n'.join(info_lines))
         self.piano.display(self.segments, self.percussion)
         dialog.close()
 
+    def settings(self) -> AnalysisSettings:
+        bands = dict(PERCUSSION_BANDS)
+        bands['Hi-hat'] = (self.hihat_spin.value(), None)
+        cleanup = None
+        if self.clean_check.isChecked():
+            cleanup = NoteCleanup(min_duration=self.min_note_spin.value() / 1000)
+        start, end = self.split_start.value(), self.split_end.value()
+        return AnalysisSettings(
+            fmin=librosa.note_to_hz(self.fmin_box.currentText()),
+            fmax=librosa.note_to_hz(self.fmax_box.currentText()),
+            split=(start / 100, end / 100),
+            percussion_bands=tuple(bands.items()),
+            cleanup=cleanup,
+        )
+
     def change_view(self, index: int):
         mode = 'piano' if index == 0 else 'guitar'
         self.piano.set_mode(mode)
@@ -154,6 +242,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.file_path = None
         self.segments = []
         self.percussion = []
+        self.pipeline.clear_cache()
         self.setWindowTitle('Song Analyzer')
         self.info.clear()
         self.piano.clear()
@@ -0,0 +1,147 @@
+"""Note-event cleanup.
+
+pyin tracks change note name on every frame where the pitch crosses a
+semitone boundary, so vibrato, slides and octave glitches turn into swarms of
+very short notes.  :func:`clean_pitch_track` turns a raw f0 track into a much
+smaller set of notes by
+
+* bridging short unvoiced gaps when pyin's voiced probability stays high,
+* median filtering the pitch (in MIDI units) inside each voiced phrase,
+* applying hysteresis so a note only changes once the pitch moves clearly
+  past the semitone boundary, and
+* folding isolated notes shorter than a minimum duration into their
+  neighbours.
+"""
+
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+import scipy.ndimage
+
+
+@dataclass(frozen=True)
+class NoteCleanup:
+    """Parameters for :func:`clean_pitch_track`.
+
+    ``hysteresis`` is the distance in semitones the pitch must move beyond the
+    half-semitone boundary before a new note starts.  Gaps of at most
+    ``max_gap`` seconds are bridged when the mean voiced probability over the
+    gap is at least ``gap_voicing``.
+    """
+
+    median_frames: int = 5
+    hysteresis: float = 0.3
+    min_duration: float = 0.08
+    max_gap: float = 0.1
+    gap_voicing: float = 0.1
+
+
+def clean_pitch_track(
+    f0: np.ndarray,
+    voiced_prob: np.ndarray,
+    sr: int,
+    hop_length: int = 512,
+    config: NoteCleanup = NoteCleanup(),
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Convert a pyin f0 track into cleaned notes.
+
+    ``f0`` holds ``NaN`` for unvoiced frames, as returned by ``librosa.pyin``.
+    Returns ``(starts, durations, midi)`` arrays with times in seconds
+    relative to the first frame.
+    """
+    hop = hop_length / sr
+    voiced = np.flatnonzero(~np.isnan(f0))
+    if len(voiced) == 0:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=int)
+    pitch = 12 * (np.log2(f0[voiced]) - np.log2(440.0)) + 69
+
+    # Split into phrases at unvoiced gaps that are too long or too confidently
+    # unvoiced to bridge.
+    gaps = np.diff(voiced) - 1
+    prob_sum = np.concatenate([[0.0], np.cumsum(voiced_prob)])
+    gap_prob = (prob_sum[voiced[1:]] - prob_sum[voiced[:-1] + 1]) / np.maximum(gaps, 1)
+    bridged = (gaps * hop <= config.max_gap) & (gap_prob >= config.gap_voicing)
+    breaks = np.flatnonzero((gaps > 0) & ~bridged) + 1
+    phrase = np.zeros(len(voiced), dtype=int)
+    phrase[breaks] = 1
+    phrase = np.cumsum(phrase)
+
+    if config.median_frames > 1:
+        pitch = np.concatenate(
+            [
+                scipy.ndimage.median_filter(part, size=config.median_frames, mode='nearest')
+                for part in np.split(pitch, breaks)
+            ]
+        )
+
+    # Runs of constant rounded pitch within a phrase.
+    rounded = np.rint(pitch).astype(int)
+    change = np.flatnonzero((np.diff(rounded) != 0) | (np.diff(phrase) != 0)) + 1
+    run_starts = np.concatenate([[0], change])
+    run_ends = np.concatenate([change, [len(voiced)]])
+    run_sums = np.add.reduceat(pitch, run_starts)
+    run_means = run_sums / (run_ends - run_starts)
+
+    # Hysteresis: a run only starts a new note if its mean pitch is clearly
+    # outside the current note's semitone.
+    notes = []  # [phrase, start, end, midi]
+    limit = 0.5 + config.hysteresis
+    for start, end, mean in zip(run_starts, run_ends, run_means):
+        prev = notes[-1] if notes else None
+        if prev is not None and prev[0] == phrase[start] and abs(mean - prev[3]) <= limit:
+            prev[2] = end
+        else:
+            notes.append([phrase[start], start, end, int(rounded[start])])
+
+    times = voiced * hop
+
+    def span(note, following):
+        start = times[note[1]]
+        if following is not None and following[0] == note[0]:
+            return start, times[following[1]]
+        return start, times[note[2] - 1] + hop
+
+    # Fold isolated short notes (glitches between two held notes) into a
+    # neighbour.  The decision uses the original neighbours so a short note is
+    # never judged against a note that has already absorbed others.  Runs of
+    # short notes and short notes alone in their phrase are kept as played.
+    spans = [span(note, nxt) for note, nxt in zip(notes, notes[1:] + [None])]
+    short = np.array([end - start for start, end in spans]) < config.min_duration
+    phrases = np.array([note[0] for note in notes])
+    same_prev = np.concatenate([[False], phrases[1:] == phrases[:-1]])
+    same_next = np.concatenate([phrases[1:] == phrases[:-1], [False]])
+    short_prev = same_prev & np.concatenate([[False], short[:-1]])
+    short_next = same_next & np.concatenate([short[1:], [False]])
+    isolated = short & ~short_prev & ~short_next
+    into_prev = isolated & same_prev
+    into_next = isolated & ~same_prev & same_next
+
+    kept = []
+    pending_start = None
+    for i, note in enumerate(notes):
+        if into_prev[i]:
+            kept[-1][2] = note[2]
+            continue
+        if into_next[i]:
+            pending_start = note[1]
+            continue
+        note = list(note)
+        if pending_start is not None:
+            note[1] = pending_start
+            pending_start = None
+        if kept and kept[-1][0] == note[0] and kept[-1][3] == note[3]:
+            kept[-1][2] = note[2]
+        else:
+            kept.append(note)
+
+    starts = np.empty(len(kept))
+    durations = np.empty(len(kept))
+    midi = np.empty(len(kept), dtype=int)
+    for i, note in enumerate(kept):
+        following = kept[i + 1] if i + 1 < len(kept) else None
+        start, end = span(note, following)
+        starts[i] = start
+        durations[i] = end - start
+        midi[i] = note[3]
+    return starts, durations, midi
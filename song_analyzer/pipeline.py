@@ -0,0 +1,239 @@
+"""Stage graph for song analysis.
+
+The analysis is split into stages (decode, segment split, HPSS, onsets,
+pitch, notes, tempo, key and percussion labelling).  Each stage declares the
+stages it depends on and the :class:`AnalysisSettings` fields it reads.
+:class:`AnalysisPipeline` runs independent stages concurrently and memoizes
+every stage's output under a key built from its settings and the keys of its
+inputs, so changing a setting only re-runs the stages downstream of it.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, fields, replace
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import librosa
+
+from .analysis import (
+    PERCUSSION_BANDS,
+    PITCH_FMAX,
+    PITCH_FMIN,
+    SEGMENT_SPLIT,
+    PercussionEvent,
+    SegmentAnalysis,
+    _count_raw_notes,
+    _estimate_key,
+    _estimate_tempo,
+    _label_hits,
+    _percussive_onsets,
+    _segment_notes,
+    _split_segments,
+    _track_pitch,
+)
+from .note_cleanup import NoteCleanup
+
+
+@dataclass(frozen=True)
+class AnalysisSettings:
+    """User-adjustable analysis parameters.
+
+    ``split`` holds the Intro/Mid and Mid/Outro boundaries as fractions of the
+    song length.  ``percussion_bands`` is a tuple of ``(label, (low, high))``
+    pairs in Hz.
+    """
+
+    fmin: float = PITCH_FMIN
+    fmax: float = PITCH_FMAX
+    split: Tuple[float, float] = SEGMENT_SPLIT
+    percussion_bands: Tuple[Tuple[str, Tuple[float, Optional[float]]], ...] = tuple(
+        PERCUSSION_BANDS.items()
+    )
+    cleanup: Optional[NoteCleanup] = NoteCleanup()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """A pipeline step.
+
+    ``func`` is called with the outputs of ``deps`` as positional arguments
+    followed by the settings named in ``params`` as keyword arguments.
+    """
+
+    name: str
+    func: Callable[..., Any]
+    deps: Tuple[str, ...] = ()
+    params: Tuple[str, ...] = ()
+
+
+def _decode(source):
+    # ``source`` is ``(path, mtime, size)`` so edits to the file invalidate it.
+    return librosa.load(source[0])
+
+
+def _segments(decoded, split):
+    y, sr = decoded
+    return _split_segments(y, sr, split)
+
+
+def _percussive(decoded):
+    y, _ = decoded
+    return librosa.effects.hpss(y)[1]
+
+
+def _onsets(decoded, y_perc):
+    return _percussive_onsets(y_perc, decoded[1])
+
+
+def _percussion(decoded, onsets, percussion_bands):
+    onset_frames, S = onsets
+    return _label_hits(onset_frames, S, decoded[1], dict(percussion_bands))
+
+
+def _pitch(decoded, segments, fmin, fmax):
+    sr = decoded[1]
+    return [_track_pitch(seg, sr, fmin, fmax) for _, seg, _ in segments]
+
+
+def _notes(decoded, segments, pitch, cleanup):
+    sr = decoded[1]
+    return [
+        _segment_notes(f0, voiced_prob, sr, offset, cleanup)
+        for (_, _, offset), (f0, voiced_prob) in zip(segments, pitch)
+    ]
+
+
+def _raw_counts(pitch):
+    return [_count_raw_notes(f0) for f0, _ in pitch]
+
+
+def _tempo(decoded, segments):
+    return [_estimate_tempo(seg, decoded[1]) for _, seg, _ in segments]
+
+
+def _key(decoded, segments):
+    return [_estimate_key(seg, decoded[1]) for _, seg, _ in segments]
+
+
+STAGES: Tuple[Stage, ...] = (
+    Stage('decode', _decode, params=('source',)),
+    Stage('segments', _segments, ('decode',), ('split',)),
+    Stage('percussive', _percussive, ('decode',)),
+    Stage('onsets', _onsets, ('decode', 'percussive')),
+    Stage('percussion', _percussion, ('decode', 'onsets'), ('percussion_bands',)),
+    Stage('pitch', _pitch, ('decode', 'segments'), ('fmin', 'fmax')),
+    Stage('notes', _notes, ('decode', 'segments', 'pitch'), ('cleanup',)),
+    Stage('raw_counts', _raw_counts, ('pitch',)),
+    Stage('tempo', _tempo, ('decode', 'segments')),
+    Stage('key', _key, ('decode', 'segments')),
+)
+
+
+def _timed(func: Callable[..., Any], args: Sequence[Any], kwargs: Dict[str, Any]):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+class AnalysisPipeline:
+    """Concurrent, memoizing runner for :data:`STAGES`.
+
+    Each stage keeps its ``cache_size`` most recently used results.  After a
+    run, :attr:`last_run` maps the name of every stage that actually executed
+    to its duration in seconds; stages served from the cache are absent.
+    """
+
+    def __init__(
+        self,
+        stages: Sequence[Stage] = STAGES,
+        max_workers: Optional[int] = None,
+        cache_size: int = 4,
+    ):
+        seen = set()
+        for stage in stages:
+            missing = [d for d in stage.deps if d not in seen]
+            if missing:
+                raise ValueError(f"Stage {stage.name!r} depends on unknown or later stages {missing}")
+            seen.add(stage.name)
+        self.stages = tuple(stages)
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self.last_run: Dict[str, float] = {}
+        self._cache: Dict[str, OrderedDict] = {}
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def run(
+        self, path: str, settings: AnalysisSettings = AnalysisSettings()
+    ) -> Tuple[List[SegmentAnalysis], List[PercussionEvent]]:
+        """Analyze ``path``, re-using cached stage results where possible.
+
+        The returned events are copies, so callers may edit them without
+        affecting the cache.
+        """
+        stat = os.stat(path)
+        values = {f.name: getattr(settings, f.name) for f in fields(settings)}
+        values['source'] = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        outputs = self._execute(values)
+
+        analyses = [
+            SegmentAnalysis(
+                name=name,
+                key=key,
+                tempo=tempo,
+                notes=[replace(note) for note in notes],
+                raw_note_count=raw_count,
+            )
+            for (name, _, _), key, tempo, notes, raw_count in zip(
+                outputs['segments'],
+                outputs['key'],
+                outputs['tempo'],
+                outputs['notes'],
+                outputs['raw_counts'],
+            )
+        ]
+        return analyses, [replace(hit) for hit in outputs['percussion']]
+
+    def _execute(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        keys: Dict[str, Any] = {}
+        outputs: Dict[str, Any] = {}
+        pending = list(self.stages)
+        running = {}
+        self.last_run = {}
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            while pending or running:
+                # Stages are topologically ordered, so one pass resolves whole
+                # chains of cache hits.
+                for stage in list(pending):
+                    if not all(d in outputs for d in stage.deps):
+                        continue
+                    pending.remove(stage)
+                    key = (
+                        tuple(values[p] for p in stage.params),
+                        tuple(keys[d] for d in stage.deps),
+                    )
+                    keys[stage.name] = key
+                    cache = self._cache.setdefault(stage.name, OrderedDict())
+                    if key in cache:
+                        cache.move_to_end(key)
+                        outputs[stage.name] = cache[key]
+                        continue
+                    args = [outputs[d] for d in stage.deps]
+                    kwargs = {p: values[p] for p in stage.params}
+                    running[pool.submit(_timed, stage.func, args, kwargs)] = stage
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    result, elapsed = future.result()
+                    outputs[stage.name] = result
+                    self.last_run[stage.name] = elapsed
+                    cache = self._cache[stage.name]
+                    cache[keys[stage.name]] = result
+                    while len(cache) > self.cache_size:
+                        cache.popitem(last=False)
+        return outputs